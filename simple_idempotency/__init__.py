@@ -1 +1,3 @@
 from .decorators import require_idempotency_key
+
+default_app_config = "simple_idempotency.apps.SimpleIdempotencyConfig"
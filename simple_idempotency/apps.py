@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+
+
+class SimpleIdempotencyConfig(AppConfig):
+    name = "simple_idempotency"
+
+    def ready(self):
+        # Resolve the settings (including the LOCK_CLASS/STORAGE_CLASS
+        # import strings) and build the shared lock/storage instances at
+        # boot, so the first request doesn't pay the import and
+        # construction cost.
+        from simple_idempotency.decorators import _get_runtime
+
+        _get_runtime()
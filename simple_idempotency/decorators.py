@@ -1,74 +1,456 @@
+import asyncio
 import hashlib
+import hmac
+import inspect
+import threading
+import time
 from functools import wraps
+from typing import Dict, Optional, Tuple
 
-from simple_idempotency.settings import idempotency_settings
+from asgiref.sync import sync_to_async
+from django.core.signals import setting_changed
+
+from simple_idempotency.settings import SETTINGS_NAME, idempotency_settings
 from simple_idempotency.utils import bad_response, get_cache_key, is_success
 
+# Marker stored by storage.add() while the first worker runs the view. It
+# expires with LOCK_TTL, mirroring a forcefully released lock.
+_PENDING = (b"__pending__", None)
+
+
+class _Runtime:
+    """
+    Hot-path state shared by all decorated views: the settings values read on
+    every request, resolved once, and a single lock/storage instance so that
+    e.g. RedisLock does not reparse its URL and rebuild a connection pool on
+    each request.
+    """
+
+    __slots__ = (
+        "safe_methods",
+        "header",
+        "get_cache_key",
+        "bad_response",
+        "max_body_bytes",
+        "lock_key_template",
+        "atomic_key_reservation",
+        "lock",
+        "storage",
+    )
+
+    def __init__(self):
+        # frozenset gives O(1) membership even when users configure a tuple.
+        self.safe_methods = frozenset(idempotency_settings.SAFE_METHODS)
+        self.header = idempotency_settings.HEADER
+        self.get_cache_key = idempotency_settings.GET_CACHE_KEY_FUNCTION
+        self.bad_response = idempotency_settings.BAD_RESPONSE_FUNCTION
+        self.max_body_bytes = idempotency_settings.MAX_BODY_BYTES
+        self.lock_key_template = idempotency_settings.LOCK_KEY_TEMPLATE
+        self.atomic_key_reservation = idempotency_settings.ATOMIC_KEY_RESERVATION
+        self.lock = idempotency_settings.LOCK_CLASS()
+        self.storage = idempotency_settings.STORAGE_CLASS()
+
+
+_runtime = None
+
+
+def _get_runtime():
+    global _runtime
+    if _runtime is None:
+        _runtime = _Runtime()
+    return _runtime
+
+
+def _clear_runtime(*args, **kwargs):
+    # CACHES is watched too because CacheKeyStorage holds a reference
+    # to a configured cache backend.
+    if kwargs["setting"] in (SETTINGS_NAME, "CACHES"):
+        global _runtime
+        _runtime = None
+
+
+setting_changed.connect(_clear_runtime)
+
+
+class _InflightEntry:
+    """A request being executed right now, with its eventual result."""
+
+    __slots__ = ("event", "result")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Optional[Tuple] = None
+
+
+# In-flight requests of this process, keyed by the hashed cache key. The first
+# request with a given key executes the view; concurrent duplicates wait on its
+# entry and reuse the published result instead of taking the distributed lock
+# and executing the view again.
+_inflight_guard = threading.Lock()
+_inflight: Dict[str, _InflightEntry] = {}
+
+
+def _hash_body(request):
+    """Raw digest of the request body; it compares and pickles at half the
+    size of a hex string."""
+    digest = getattr(request, "_idempotency_body_hash", None)
+    if digest is not None:
+        return digest
+    return hashlib.blake2b(request.body, digest_size=32).digest()
+
+
+def _respond_from_cached(runtime, request, value):
+    """Return the cached response if the request body matches the stored
+    digest, otherwise the reused-key error response."""
+    cached_request_body_hash, cached_response = value
+    if hmac.compare_digest(_hash_body(request), cached_request_body_hash):
+        return cached_response
+    return runtime.bad_response(
+        "You've already used this idempotency key. "
+        "Please, repeat the request with another idempotency key.",
+    )
+
+
+def _wait_for_result(storage, key, timeout):
+    """
+    Poll the storage while another worker holds the pending marker. Returns
+    the published value, or None when the marker disappeared or the timeout
+    passed without a result.
+    """
+    deadline = time.monotonic() + timeout
+    interval = 0.05
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        value = storage.get(key)
+        if value != _PENDING:
+            return value
+        interval = min(interval * 2, 1.0)
+    return None
+
 
 def require_idempotency_key(view_func):
     """Decorator that added idempotency key processing logic to a view."""
+    # The calling convention is fixed at decoration time: ViewSet actions
+    # receive (self, request), plain views just the request. Emitting a
+    # specialized wrapper for each removes the per-call unpack and branch.
+    try:
+        parameters = inspect.signature(view_func).parameters
+        is_method = next(iter(parameters), None) == "self"
+    except (TypeError, ValueError):
+        is_method = False
+
+    # Async views get an async-native wrapper, so ASGI deployments don't pay
+    # a thread-pool hop to run the idempotency flow.
+    if asyncio.iscoroutinefunction(view_func):
+        if is_method:
+
+            @wraps(view_func)
+            async def wrapped_view(self, request, *args, **kwargs):
+                runtime = _get_runtime()
+                # If a method in SAFE_METHODS just return a response.
+                if request.method in runtime.safe_methods:
+                    return await view_func(self, request, *args, **kwargs)
+                return await _process_async(
+                    view_func, self, request, (self, request, *args), kwargs, runtime
+                )
+
+        else:
+
+            @wraps(view_func)
+            async def wrapped_view(request, *args, **kwargs):
+                runtime = _get_runtime()
+                # If a method in SAFE_METHODS just return a response.
+                if request.method in runtime.safe_methods:
+                    return await view_func(request, *args, **kwargs)
+                return await _process_async(
+                    view_func, None, request, (request, *args), kwargs, runtime
+                )
 
-    @wraps(view_func)
-    def wrapped_view(*args, **kwargs):
-        # args can contain either (HttpRequest,) or (ViewSet, HttpRequest).
-        view_set, request = args if len(args) > 1 else (None, *args)
-
-        # If a method in SAFE_METHODS just return a response.
-        if request.method in idempotency_settings.SAFE_METHODS:
-            return view_func(*args, *kwargs)
-
-        # Try to get idempotency key from headers.
-        idempotency_key_from_header = request.META.get(idempotency_settings.HEADER)
-        if not idempotency_key_from_header:
-            return idempotency_settings.BAD_RESPONSE_FUNCTION(
-                "Idempotency key is missing. "
-                "Generate a unique key and specify it in the header"
+    elif is_method:
+
+        @wraps(view_func)
+        def wrapped_view(self, request, *args, **kwargs):
+            runtime = _get_runtime()
+            # If a method in SAFE_METHODS just return a response.
+            if request.method in runtime.safe_methods:
+                return view_func(self, request, *args, **kwargs)
+            return _process(
+                view_func, self, request, (self, request, *args), kwargs, runtime
             )
 
-        # Generate a hashed cache key.
-        key = idempotency_settings.GET_CACHE_KEY_FUNCTION(
-            request, idempotency_key_from_header
-        )
-        # Get hashed value of the request's body.
-        request_body_hash = hashlib.sha256(request.body).hexdigest()
-
-        # Acquire distributed lock while processing the request.
-        mutex = idempotency_settings.LOCK_CLASS()
-        with mutex.lock(name=f"Idempotency_{key}"):
-            # Try to get the cached value.
-            storage = idempotency_settings.STORAGE_CLASS()
-            value_from_cache = storage.get(key)
-
-            if value_from_cache is None:
-                response = view_func(*args, **kwargs)
-
-                # We need to finalize response for the ViewSet action.
-                if view_set is not None:
-                    response = view_set.finalize_response(request, response)
-
-                # Store hash value of request body with the rendered response
-                # in the cache only if the response is success.
-                if is_success(response.status_code):
-                    storage.set(
-                        key,
-                        (
-                            request_body_hash,
-                            response.render()
-                            if hasattr(response, "render")
-                            else response,
-                        ),
-                    )
-                return response
-
-            # Otherwise, process cached value.
-            cached_request_body_hash, cached_response = value_from_cache
-            # The current request body hash and cached value are the same.
-            if request_body_hash == cached_request_body_hash:
-                return cached_response
-            # The same idempotency key was used with a different request body.
-            return idempotency_settings.BAD_RESPONSE_FUNCTION(
-                "You've already used this idempotency key. "
-                "Please, repeat the request with another idempotency key.",
+    else:
+
+        @wraps(view_func)
+        def wrapped_view(request, *args, **kwargs):
+            runtime = _get_runtime()
+            # If a method in SAFE_METHODS just return a response.
+            if request.method in runtime.safe_methods:
+                return view_func(request, *args, **kwargs)
+            return _process(
+                view_func, None, request, (request, *args), kwargs, runtime
             )
 
     return wrapped_view
+
+
+def _prepare_key(request, runtime):
+    """
+    Validate the idempotency header and derive the sharded cache key.
+    Returns (key, None) on success, (None, error response) otherwise.
+    """
+    # Try to get idempotency key from headers.
+    idempotency_key_from_header = request.META.get(runtime.header)
+    if not idempotency_key_from_header:
+        return None, runtime.bad_response(
+            "Idempotency key is missing. "
+            "Generate a unique key and specify it in the header"
+        )
+
+    # Bodies above MAX_BODY_BYTES are never buffered and hashed here;
+    # a client-supplied digest header stands in for the body hash, so
+    # large uploads keep streaming.
+    content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+    if content_length > runtime.max_body_bytes:
+        digest_header = request.META.get("HTTP_CONTENT_MD5") or request.META.get(
+            "HTTP_DIGEST"
+        )
+        if not digest_header:
+            return None, runtime.bad_response(
+                "Request body is too large to hash for idempotency. "
+                "Supply a Content-MD5 or Digest header."
+            )
+        request._idempotency_body_hash = hashlib.blake2b(
+            digest_header.encode(), digest_size=32
+        ).digest()
+
+    # Generate a hashed cache key. The body is only hashed on the paths
+    # that actually need it, so requests which never compare or store a
+    # digest do not pay an O(|body|) pass.
+    key = runtime.get_cache_key(request, idempotency_key_from_header)
+    # Shard the key space: on Redis Cluster the hash tag in the default
+    # template spreads keys by their first two characters instead of hashing
+    # them all through one hotspot, while a request's lock and value stay
+    # together.
+    return runtime.lock_key_template.format(shard=key[:2], key=key), None
+
+
+def _process(view_func, view_set, request, args, kwargs, runtime):
+    """The non-safe-method flow shared by both sync wrapper flavors."""
+    key, error = _prepare_key(request, runtime)
+    if key is None:
+        return error
+    storage = runtime.storage
+
+    # Fast path: a completed response may already be cached, and reading
+    # it needs no locking at all.
+    value_from_cache = storage.get(key)
+    if value_from_cache is not None and value_from_cache != _PENDING:
+        return _respond_from_cached(runtime, request, value_from_cache)
+
+    # Collapse concurrent duplicates within this process before touching
+    # the storage reservation or the distributed lock.
+    entry = None
+    with _inflight_guard:
+        pending = _inflight.get(key)
+        if pending is None:
+            entry = _inflight[key] = _InflightEntry()
+
+    if pending is not None:
+        pending.event.wait()
+        if pending.result is not None:
+            return _respond_from_cached(runtime, request, pending.result)
+        # The first request did not publish a result (an error or a
+        # non-success response); process this one normally below.
+
+    try:
+        if runtime.atomic_key_reservation:
+            return _process_with_reservation(
+                view_func, args, kwargs, view_set, request, runtime, key, entry
+            )
+        return _process_with_lock(
+            view_func, args, kwargs, view_set, request, runtime, key, entry
+        )
+    finally:
+        if entry is not None:
+            entry.event.set()
+            with _inflight_guard:
+                _inflight.pop(key, None)
+
+
+def _execute_and_store(view_func, args, kwargs, view_set, request, storage, key, entry):
+    """Run the view and, on success, cache and publish its rendered response."""
+    response = view_func(*args, **kwargs)
+
+    # We need to finalize response for the ViewSet action.
+    if view_set is not None:
+        response = view_set.finalize_response(request, response)
+
+    # Store hash value of request body with the rendered response in the
+    # cache only if the response is success.
+    if is_success(response.status_code):
+        value = (
+            _hash_body(request),
+            response.render() if hasattr(response, "render") else response,
+        )
+        storage.set(key, value)
+        if entry is not None:
+            entry.result = value
+    return response
+
+
+def _process_with_reservation(
+    view_func, args, kwargs, view_set, request, runtime, key, entry
+):
+    """
+    Reserve the key with a single atomic storage add(); the pending marker
+    plays the role of the distributed lock. Cache misses cost one extra
+    round-trip instead of the lock's acquire/release exchanges.
+    """
+    storage = runtime.storage
+    lock_ttl = idempotency_settings.LOCK_TTL_SECONDS
+
+    while not storage.add(key, _PENDING, timeout=lock_ttl):
+        # Another worker is executing this request; wait for its result.
+        value_from_cache = storage.get(key)
+        if value_from_cache == _PENDING:
+            value_from_cache = _wait_for_result(storage, key, lock_ttl)
+        if value_from_cache is not None:
+            if entry is not None:
+                entry.result = value_from_cache
+            return _respond_from_cached(runtime, request, value_from_cache)
+        # The marker disappeared without a result; try to take it over.
+
+    stored = False
+    try:
+        response = _execute_and_store(
+            view_func, args, kwargs, view_set, request, storage, key, entry
+        )
+        stored = is_success(response.status_code)
+        return response
+    finally:
+        if not stored:
+            # Release the reservation so the request can be retried.
+            storage.delete(key)
+
+
+class _AsyncInflightEntry:
+    """Async twin of _InflightEntry, for duplicates on the same event loop."""
+
+    __slots__ = ("event", "result")
+
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.result: Optional[Tuple] = None
+
+
+_async_inflight: Dict[str, _AsyncInflightEntry] = {}
+
+
+async def _process_async(view_func, view_set, request, args, kwargs, runtime):
+    """
+    Async twin of _process. Storage calls are offloaded with sync_to_async
+    (Django's cache API is sync-only here) and in-process duplicates share an
+    asyncio.Event instead of blocking threads. Reservation via atomic add()
+    is always used: the LOCK_CLASS context managers are sync and would hold a
+    worker thread for the whole view.
+    """
+    key, error = _prepare_key(request, runtime)
+    if key is None:
+        return error
+    storage = runtime.storage
+    storage_get = sync_to_async(storage.get, thread_sensitive=False)
+
+    # Fast path: a completed response may already be cached.
+    value_from_cache = await storage_get(key)
+    if value_from_cache is not None and value_from_cache != _PENDING:
+        return _respond_from_cached(runtime, request, value_from_cache)
+
+    # Collapse concurrent duplicates on this event loop.
+    entry = None
+    with _inflight_guard:
+        pending = _async_inflight.get(key)
+        if pending is None:
+            entry = _async_inflight[key] = _AsyncInflightEntry()
+
+    if pending is not None:
+        await pending.event.wait()
+        if pending.result is not None:
+            return _respond_from_cached(runtime, request, pending.result)
+        # The first request did not publish a result (an error or a
+        # non-success response); process this one normally below.
+
+    lock_ttl = idempotency_settings.LOCK_TTL_SECONDS
+    storage_add = sync_to_async(storage.add, thread_sensitive=False)
+    try:
+        while not await storage_add(key, _PENDING, lock_ttl):
+            # Another worker is executing this request; wait for its result.
+            value_from_cache = await storage_get(key)
+            if value_from_cache == _PENDING:
+                value_from_cache = await _await_result(storage_get, key, lock_ttl)
+            if value_from_cache is not None:
+                if entry is not None:
+                    entry.result = value_from_cache
+                return _respond_from_cached(runtime, request, value_from_cache)
+            # The marker disappeared without a result; try to take it over.
+
+        stored = False
+        try:
+            response = await view_func(*args, **kwargs)
+
+            # We need to finalize response for the ViewSet action.
+            if view_set is not None:
+                response = view_set.finalize_response(request, response)
+
+            # Store hash value of request body with the rendered response in
+            # the cache only if the response is success.
+            if is_success(response.status_code):
+                value = (
+                    _hash_body(request),
+                    response.render() if hasattr(response, "render") else response,
+                )
+                await sync_to_async(storage.set, thread_sensitive=False)(key, value)
+                if entry is not None:
+                    entry.result = value
+                stored = True
+            return response
+        finally:
+            if not stored:
+                # Release the reservation so the request can be retried.
+                await sync_to_async(storage.delete, thread_sensitive=False)(key)
+    finally:
+        if entry is not None:
+            entry.event.set()
+            with _inflight_guard:
+                _async_inflight.pop(key, None)
+
+
+async def _await_result(storage_get, key, timeout):
+    """Async twin of _wait_for_result; polls without blocking the loop."""
+    deadline = time.monotonic() + timeout
+    interval = 0.05
+    while time.monotonic() < deadline:
+        await asyncio.sleep(interval)
+        value = await storage_get(key)
+        if value != _PENDING:
+            return value
+        interval = min(interval * 2, 1.0)
+    return None
+
+
+def _process_with_lock(view_func, args, kwargs, view_set, request, runtime, key, entry):
+    """Fallback flow guarded by LOCK_CLASS for storages without atomic add()
+    semantics worth trusting."""
+    # The key already carries the shard template, so the lock shares the
+    # storage key's cluster slot.
+    with runtime.lock.lock(name=f"Idempotency_{key}"):
+        storage = runtime.storage
+        value_from_cache = storage.get(key)
+
+        if value_from_cache is None:
+            return _execute_and_store(
+                view_func, args, kwargs, view_set, request, storage, key, entry
+            )
+
+        if entry is not None:
+            entry.result = value_from_cache
+        return _respond_from_cached(runtime, request, value_from_cache)
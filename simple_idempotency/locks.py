@@ -1,12 +1,29 @@
 import abc
 import threading
+from typing import Dict
 
-from redis import Redis
+from redis import BlockingConnectionPool, Redis
 
 from simple_idempotency.settings import idempotency_settings
 
 __all__ = "ThreadLock", "RedisLock"
 
+# One client (and its connection pool) per URL per process, so repeated
+# RedisLock construction never reparses the URL or rebuilds a pool.
+_clients: Dict[str, Redis] = {}
+
+
+def _client_for(url: str) -> Redis:
+    try:
+        return _clients[url]
+    except KeyError:
+        client = Redis(
+            connection_pool=BlockingConnectionPool.from_url(
+                url, health_check_interval=30
+            )
+        )
+        return _clients.setdefault(url, client)
+
 
 class BaseLock(abc.ABC):
     @abc.abstractmethod
@@ -32,15 +49,18 @@ class RedisLock(BaseLock):
     """
 
     def __init__(self):
-        self._redis = Redis.from_url(idempotency_settings.LOCK_REDIS_LOCATION)
+        self._redis = _client_for(idempotency_settings.LOCK_REDIS_LOCATION)
 
     def lock(self, name: str, **kwargs):  # type: ignore
         return self._redis.lock(
             name=name,
             # Time before lock is forcefully released.
-            timeout=idempotency_settings.LOCK_TTL.total_seconds(),
+            timeout=idempotency_settings.LOCK_TTL_SECONDS,
             # A value of None indicates continue trying forever to acquire
             # the lock before release or before timeout.
             blocking_timeout=None,
+            # The lock token does not need thread-local storage; every lock
+            # object is acquired and released by the same caller.
+            thread_local=False,
             **kwargs
         )
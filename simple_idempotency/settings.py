@@ -14,14 +14,28 @@ DEFAULTS: Dict[str, Any] = {
     "HEADER": "HTTP_IDEMPOTENCY_KEY",
     # HTTP request methods that are considered safe, and are as such
     # not cached by default.
-    "SAFE_METHODS": ("GET", "HEAD", "OPTIONS", "TRACE"),
+    "SAFE_METHODS": frozenset({"GET", "HEAD", "OPTIONS", "TRACE"}),
     # Specify the storage class to be used for idempotency keys
     "STORAGE_CLASS": f"{__package__}.storages.CacheKeyStorage",
     # Name of the django cache configuration to use for the CacheStorageKey
     # storage class
     "STORAGE_CACHE_NAME": "default",
+    # Maximum number of entries MemoryKeyStorage keeps before evicting the
+    # least recently used one.
+    "MEMORY_STORAGE_MAXSIZE": 1024,
     # The duration for which a cached response is saved.
     "STORAGE_CACHE_TIMEOUT": timedelta(minutes=10),
+    # Bodies larger than this are not buffered and hashed; a client-supplied
+    # Content-MD5 or Digest header stands in for the body hash instead.
+    "MAX_BODY_BYTES": 1024 * 1024,
+    # Serializer used by CacheKeyStorage. The compact serializer only keeps
+    # status, headers, cookies and content; switch to PickleSerializer for
+    # responses carrying anything else.
+    "STORAGE_SERIALIZER": f"{__package__}.storages.CompactResponseSerializer",
+    # Reserve in-progress keys with a single atomic storage add() instead of
+    # holding LOCK_CLASS around the whole request. Saves several storage
+    # round-trips per request; disable to fall back to the distributed lock.
+    "ATOMIC_KEY_RESERVATION": True,
     # Specify the key object locking class to be used for locking access
     # to the cache storage object.
     "LOCK_CLASS": f"{__package__}.locks.ThreadLock",
@@ -30,6 +44,11 @@ DEFAULTS: Dict[str, Any] = {
     # The maximum time to live for the lock of RedisLock. If a lock is given and
     # is never released this timeout forces the release.
     "LOCK_TTL": timedelta(minutes=5),
+    # Template applied to the hashed cache key before it is used for storage
+    # and locking. The default wraps the first two hex characters in a Redis
+    # Cluster hash tag ({...}), spreading keys over 256 slots while keeping a
+    # request's lock and stored value on the same shard.
+    "LOCK_KEY_TEMPLATE": "{{idem:{shard}}}:{key}",
     # Specify a function for getting a cache key.
     "GET_CACHE_KEY_FUNCTION": f"{__package__}.utils.get_cache_key",
     # Specify a function which return bad response with a message.
@@ -38,8 +57,18 @@ DEFAULTS: Dict[str, Any] = {
     "BAD_RESPONSE_STATUS_CODE": 400,
 }
 
+# Duration settings that also get a precomputed float form (<NAME>_SECONDS),
+# so hot paths don't call timedelta.total_seconds() per request.
+DURATIONS: List[str] = ["LOCK_TTL", "STORAGE_CACHE_TIMEOUT"]
+
 # List of settings that may be in string import notation.
-IMPORT_STRINGS: List[str] = ["STORAGE_CLASS", "LOCK_CLASS"]
+IMPORT_STRINGS: List[str] = [
+    "STORAGE_CLASS",
+    "STORAGE_SERIALIZER",
+    "LOCK_CLASS",
+    "GET_CACHE_KEY_FUNCTION",
+    "BAD_RESPONSE_FUNCTION",
+]
 
 
 def import_from_string(value, setting_name):
@@ -64,25 +93,38 @@ class Settings:
             self._user_settings = getattr(settings, SETTINGS_NAME, {})
         return self._user_settings
 
+    def _populate(self):
+        """
+        Resolve every known setting into a plain instance attribute, so that
+        all later accesses are direct __dict__ loads that never reach
+        __getattr__ again.
+        """
+        user_settings = self.user_settings
+        for attr, default in DEFAULTS.items():
+            value = user_settings.get(attr, default)
+            # Coerce import strings into classes; users may also supply
+            # the callable directly.
+            if attr in IMPORT_STRINGS and isinstance(value, str):
+                value = import_from_string(value, attr)
+            self._cached_attrs.add(attr)
+            setattr(self, attr, value)
+
+        for attr in DURATIONS:
+            value = getattr(self, attr)
+            if isinstance(value, timedelta):
+                value = value.total_seconds()
+            self._cached_attrs.add(f"{attr}_SECONDS")
+            setattr(self, f"{attr}_SECONDS", float(value))
+
     def __getattr__(self, attr):
-        if attr not in DEFAULTS:
+        if attr not in DEFAULTS and attr not in (f"{d}_SECONDS" for d in DURATIONS):
             raise AttributeError(f"Invalid setting: '{attr}'")
 
-        try:
-            # Check if present in user settings
-            value = self.user_settings[attr]
-        except KeyError:
-            # Fall back to defaults
-            value = DEFAULTS[attr]
-
-        # Coerce import strings into classes
-        if attr in IMPORT_STRINGS:
-            value = import_from_string(value, attr)
-
-        # Cache the result
-        self._cached_attrs.add(attr)
-        setattr(self, attr, value)
-        return value
+        # The first access resolves the whole settings dict in one go; this
+        # cannot happen at import time because Django's settings may not be
+        # configured yet.
+        self._populate()
+        return self.__dict__[attr]
 
     def reload(self):
         for attr in self._cached_attrs:
@@ -1,60 +1,243 @@
 import abc
 import pickle
-from typing import Optional, Tuple
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
 
 from django.core.cache import caches
 from django.http import HttpResponse
 
 from simple_idempotency.settings import idempotency_settings
 
-__all__ = "MemoryKeyStorage", "CacheKeyStorage"
+__all__ = (
+    "MemoryKeyStorage",
+    "CacheKeyStorage",
+    "CompactResponseSerializer",
+    "PickleSerializer",
+)
+
+
+class PickleSerializer:
+    """
+    Serializes the cached (digest, response) tuple with pickle. Handles any
+    response object, including ones carrying non-standard attributes, at the
+    cost of pickle's speed and its well-known security caveats.
+    """
+
+    @staticmethod
+    def dumps(value: Tuple) -> bytes:
+        return pickle.dumps(value)
+
+    @staticmethod
+    def loads(blob: bytes) -> Tuple:
+        return pickle.loads(blob)
+
+
+class CompactResponseSerializer:
+    """
+    Serializes the cached (digest, response) tuple as a flat sequence of
+    length-prefixed fields: body digest, status code, headers, cookies and
+    rendered content. Considerably cheaper than pickling an HttpResponse
+    object graph, and loading it cannot execute arbitrary code.
+
+    Only the status code, headers, cookies and content survive the round
+    trip; responses relying on other attributes should use PickleSerializer.
+    """
+
+    _length = struct.Struct("!I")
+    _status = struct.Struct("!i")
+
+    @classmethod
+    def dumps(cls, value: Tuple) -> bytes:
+        body_hash, response = value
+        pack_length = cls._length.pack
+        out = [pack_length(len(body_hash)), body_hash]
+        if response is None:
+            # Pending markers carry no response.
+            out.append(cls._status.pack(-1))
+        else:
+            out.append(cls._status.pack(response.status_code))
+            fields = list(response.items())
+            for morsel in response.cookies.values():
+                fields.append(("Set-Cookie", morsel.OutputString()))
+            out.append(pack_length(len(fields)))
+            for name, field_value in fields:
+                name = name.encode("latin-1")
+                field_value = field_value.encode("latin-1")
+                out += (pack_length(len(name)), name)
+                out += (pack_length(len(field_value)), field_value)
+            out += (pack_length(len(response.content)), response.content)
+        return b"".join(out)
+
+    @classmethod
+    def loads(cls, blob: bytes) -> Tuple:
+        unpack_length = cls._length.unpack_from
+
+        def read_bytes(offset):
+            (length,) = unpack_length(blob, offset)
+            offset += cls._length.size
+            return blob[offset : offset + length], offset + length
+
+        body_hash, offset = read_bytes(0)
+        (status,) = cls._status.unpack_from(blob, offset)
+        offset += cls._status.size
+        if status == -1:
+            return body_hash, None
+
+        (field_count,) = unpack_length(blob, offset)
+        offset += cls._length.size
+        fields = []
+        for _ in range(field_count):
+            name, offset = read_bytes(offset)
+            field_value, offset = read_bytes(offset)
+            fields.append((name.decode("latin-1"), field_value.decode("latin-1")))
+        content, offset = read_bytes(offset)
+
+        response = HttpResponse(content=content, status=status)
+        for name, field_value in fields:
+            if name == "Set-Cookie":
+                response.cookies.load(field_value)
+            else:
+                response[name] = field_value
+        return body_hash, response
 
 
 class IdempotencyKeyStorageBase(abc.ABC):
     _cache = None
 
     @abc.abstractmethod
-    def get(self, key: str) -> Optional[Tuple[str, HttpResponse]]:
+    def get(self, key: str) -> Optional[Tuple[bytes, HttpResponse]]:
         """
-        Returns a tuple containing a request body's hash value with the response object.
+        Returns a tuple containing a request body's digest with the response object.
         """
 
     @abc.abstractmethod
-    def set(self, key: str, value: Tuple[str, HttpResponse]) -> None:
+    def set(self, key: str, value: Tuple[bytes, HttpResponse]) -> None:
         """
-        Store a tuple containing a request body's hash value with the response object
+        Store a tuple containing a request body's digest with the response object
         in the cache.
         """
 
+    @abc.abstractmethod
+    def add(self, key: str, value: Tuple, timeout: Optional[float] = None) -> bool:
+        """
+        Store the value only if the key is not already present (SETNX
+        semantics). Returns True if the value was stored.
+        """
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove the key from the cache, if present."""
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Tuple]:
+        """Fetch several keys at once; missing keys are omitted."""
+        result = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def set_many(self, values: Dict[str, Tuple]) -> None:
+        """Store several key/value pairs at once."""
+        for key, value in values.items():
+            self.set(key, value)
+
 
 class MemoryKeyStorage(IdempotencyKeyStorageBase):
+    """
+    Process-local storage bounded by MEMORY_STORAGE_MAXSIZE, with entries
+    expiring after STORAGE_CACHE_TIMEOUT. The least recently used key is
+    evicted once the bound is reached, so memory stays constant under load.
+    NOTE: Only for development and single-process deployments.
+    """
+
     def __init__(self):
-        self._cache = {}
+        # key -> (expiry timestamp, value), in least-recently-used order.
+        self._cache: "OrderedDict[str, Tuple[float, Tuple]]" = OrderedDict()
+        self._maxsize = idempotency_settings.MEMORY_STORAGE_MAXSIZE
+        self._ttl = idempotency_settings.STORAGE_CACHE_TIMEOUT_SECONDS
+        self._guard = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[bytes, HttpResponse]]:
+        assert self._cache is not None
+        with self._guard:
+            item = self._cache.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return value
 
-    def get(self, key: str) -> Optional[Tuple[str, HttpResponse]]:
+    def set(self, key: str, value: Tuple[bytes, HttpResponse]) -> None:
         assert self._cache is not None
-        return self._cache.get(key)
+        with self._guard:
+            self._store(key, value, self._ttl)
 
-    def set(self, key: str, value: Tuple[str, HttpResponse]) -> None:
+    def add(self, key: str, value: Tuple, timeout: Optional[float] = None) -> bool:
         assert self._cache is not None
-        self._cache[key] = value
+        with self._guard:
+            item = self._cache.get(key)
+            if item is not None and item[0] > time.monotonic():
+                return False
+            self._store(key, value, timeout or self._ttl)
+            return True
+
+    def delete(self, key: str) -> None:
+        assert self._cache is not None
+        with self._guard:
+            self._cache.pop(key, None)
+
+    def _store(self, key: str, value: Tuple, timeout: float) -> None:
+        # The caller holds self._guard.
+        self._cache[key] = (time.monotonic() + timeout, value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._maxsize:
+            self._cache.popitem(last=False)
 
 
 class CacheKeyStorage(IdempotencyKeyStorageBase):
     def __init__(self):
         self._cache = caches[idempotency_settings.STORAGE_CACHE_NAME]
+        self._serializer = idempotency_settings.STORAGE_SERIALIZER
 
-    def get(self, key: str) -> Optional[Tuple[str, HttpResponse]]:
+    def get(self, key: str) -> Optional[Tuple[bytes, HttpResponse]]:
         assert self._cache is not None
         value = self._cache.get(key)
         if value is None:
             return value
-        return pickle.loads(value)
-
-    def set(self, key: str, value: Tuple[str, HttpResponse]) -> None:
-        value_as_string = pickle.dumps(value)
-        caches[idempotency_settings.STORAGE_CACHE_NAME].set(
-            key,
-            value_as_string,
-            timeout=idempotency_settings.STORAGE_CACHE_TIMEOUT.total_seconds(),
+        return self._serializer.loads(value)
+
+    def set(self, key: str, value: Tuple[bytes, HttpResponse]) -> None:
+        self.set_many({key: value})
+
+    def set_many(self, values: Dict[str, Tuple]) -> None:
+        assert self._cache is not None
+        # set_many is a single round-trip on backends that support it
+        # (e.g. one MSET against Redis), regardless of how many keys
+        # end up in the payload.
+        self._cache.set_many(
+            {key: self._serializer.dumps(value) for key, value in values.items()},
+            timeout=idempotency_settings.STORAGE_CACHE_TIMEOUT_SECONDS,
         )
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Tuple]:
+        assert self._cache is not None
+        return {
+            key: self._serializer.loads(value)
+            for key, value in self._cache.get_many(keys).items()
+        }
+
+    def add(self, key: str, value: Tuple, timeout: Optional[float] = None) -> bool:
+        assert self._cache is not None
+        # Every Django cache backend implements add() with SETNX semantics.
+        return self._cache.add(key, self._serializer.dumps(value), timeout=timeout)
+
+    def delete(self, key: str) -> None:
+        assert self._cache is not None
+        self._cache.delete(key)
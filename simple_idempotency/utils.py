@@ -1,26 +1,72 @@
+import base64
+import functools
 import hashlib
+import json
 
-from django.http import JsonResponse
+from django.core.signals import setting_changed
+from django.http import HttpRequest, HttpResponse
 
-from simple_idempotency.settings import idempotency_settings
+from simple_idempotency.settings import SETTINGS_NAME, idempotency_settings
 
 __all__ = "bad_response", "get_cache_key"
 
 
-def bad_response(message, **kwargs):
-    return JsonResponse(
-        {"error": message}, status=idempotency_settings.BAD_RESPONSE_STATUS_CODE
+@functools.lru_cache(maxsize=16)
+def _bad_response_content(message: str) -> bytes:
+    return json.dumps({"error": message}).encode()
+
+
+def bad_response(message: str, **kwargs) -> HttpResponse:
+    # The same few error strings repeat, so their JSON is rendered once and
+    # reused; a fresh HttpResponse is still built per request since
+    # middleware may mutate it.
+    return HttpResponse(
+        _bad_response_content(message),
+        status=idempotency_settings.BAD_RESPONSE_STATUS_CODE,
+        content_type="application/json",
     )
 
 
-def get_cache_key(request, idempotency_key):
-    m = hashlib.sha256()
-    m.update(idempotency_key.encode())
-    m.update(request.path_info.encode())
-    m.update(request.method.encode())
-    m.update(str(getattr(request.user, "id", "")).encode())
-    return m.hexdigest()
+@functools.lru_cache(maxsize=4096)
+def _hashed_key(
+    idempotency_key: str, path_info: str, method: str, user_id: str
+) -> str:
+    # blake2b is noticeably faster than sha256 on short inputs, and feeding
+    # one pre-joined buffer keeps the whole derivation a single C call.
+    digest = hashlib.blake2b(
+        b"\x00".join(
+            (
+                idempotency_key.encode(),
+                path_info.encode(),
+                method.encode(),
+                user_id.encode(),
+            )
+        ),
+        digest_size=16,
+    ).digest()
+    # Cache backends want a str key; urlsafe base64 gives 22 characters
+    # against hexdigest's 32.
+    return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")
+
+
+def get_cache_key(request: HttpRequest, idempotency_key: str) -> str:
+    # Retries repeat the same four inputs, so the derived key is memoized;
+    # maxsize bounds the cache under adversarial clients.
+    return _hashed_key(
+        idempotency_key,
+        request.path_info,
+        request.method,
+        str(getattr(request.user, "id", "")),
+    )
+
+
+def is_success(code: int) -> bool:
+    return 200 <= code <= 299
+
+
+def _clear_key_cache(*args, **kwargs):
+    if kwargs["setting"] == SETTINGS_NAME:
+        _hashed_key.cache_clear()
 
 
-def is_success(code):
-    return 200 <= code <= 299
\ No newline at end of file
+setting_changed.connect(_clear_key_cache)
\ No newline at end of file